@@ -1,12 +1,108 @@
 import argparse
+import gzip
+import re
 from pathlib import Path
+from types import SimpleNamespace
 
-import folium
 import numpy as np
 import pandas as pd
 import yaml
-from IPython.display import display
-from pypsa import Network
+
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:  # libyaml not available
+    from yaml import SafeLoader as _SafeLoader
+
+
+# Static columns build_map relies on, with PyPSA's defaults (PyPSA drops all-default
+# columns when exporting to netCDF, so they may be absent from the file).
+_LIGHT_COMPONENTS = {
+    "buses": {"x": 0.0, "y": 0.0},
+    "loads": {"bus": ""},
+    "generators": {"bus": "", "p_nom": 0.0, "carrier": ""},
+    "storage_units": {"bus": "", "p_nom": 0.0, "carrier": ""},
+    "lines": {"bus0": "", "bus1": "", "s_nom": 0.0},
+    "links": {"bus0": "", "bus1": "", "p_nom": 0.0},
+}
+
+
+def load_network_light(net_path: Path):
+    """
+    Read only what build_map needs from a PyPSA netCDF file (static component tables,
+    loads_t.p_set and snapshots) into a Network-like namespace, skipping every other
+    variable (shapes, other time series, results) instead of materialising it.
+    """
+    import xarray as xr
+
+    static_prefixes = tuple(f"{c}_" for c in _LIGHT_COMPONENTS)
+    series_prefixes = tuple(f"{c}_t_" for c in _LIGHT_COMPONENTS)
+
+    def _wanted(var):
+        if var.startswith(("snapshots", "loads_t_p_set")):
+            return True
+        return var.startswith(static_prefixes) and not var.startswith(series_prefixes)
+
+    # opening is lazy, so probing the variable names reads metadata only
+    with xr.open_dataset(net_path) as probe:
+        drop = [v for v in probe.variables if not _wanted(v)]
+
+    with xr.open_dataset(net_path, drop_variables=drop) as ds:
+        ds = ds.load()
+
+    # PyPSA stores `snapshots` as a 0..N-1 range; the actual labels live in
+    # snapshots_snapshot, or snapshots_period/snapshots_timestep for multi-period networks
+    if "snapshots_snapshot" in ds.variables:
+        snapshots = pd.Index(ds["snapshots_snapshot"].values, name="snapshot")
+    elif {"snapshots_period", "snapshots_timestep"} <= set(ds.variables):
+        snapshots = pd.MultiIndex.from_arrays(
+            [ds["snapshots_period"].values, ds["snapshots_timestep"].values],
+            names=["period", "timestep"],
+        )
+    else:
+        raise ValueError("unrecognised snapshot layout in netCDF file")
+
+    def _static(comp, defaults):
+        index_var = f"{comp}_i"
+        index = pd.Index(ds[index_var].values if index_var in ds.variables else [])
+        df = pd.DataFrame(index=index)
+        prefix = f"{comp}_"
+        for var in ds.data_vars:
+            if var.startswith(prefix) and ds[var].dims == (index_var,):
+                df[var[len(prefix):]] = ds[var].values
+        for col, default in defaults.items():
+            if col not in df.columns:
+                df[col] = default
+        return df
+
+    tables = {comp: _static(comp, defaults) for comp, defaults in _LIGHT_COMPONENTS.items()}
+
+    if "loads_t_p_set" in ds.data_vars:
+        p_set = pd.DataFrame(
+            ds["loads_t_p_set"].transpose("snapshots", "loads_t_p_set_i").values,
+            index=snapshots,
+            columns=ds["loads_t_p_set_i"].values,
+        )
+    else:
+        p_set = pd.DataFrame(index=snapshots)
+
+    return SimpleNamespace(
+        snapshots=snapshots,
+        loads_t=SimpleNamespace(p_set=p_set),
+        **tables,
+    )
+
+
+def load_network(net_path: Path):
+    """
+    Load the network via load_network_light, falling back to a full pypsa.Network
+    if xarray is unavailable or the file does not have the expected layout.
+    """
+    try:
+        return load_network_light(net_path)
+    except Exception as exc:
+        print(f"Lightweight netCDF read failed ({exc!r}); loading full pypsa.Network")
+        from pypsa import Network
+        return Network(str(net_path))
 
 
 def main():
@@ -21,6 +117,12 @@ def main():
         help="Project name, matching the folder config/<project>/onepager.yaml "
              "(e.g. 'load_shedding_update')."
     )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Also write a gzip-compressed network_map.html.gz next to the HTML "
+             "(for static hosting with Content-Encoding: gzip)."
+    )
     args = parser.parse_args()
     project_arg = args.project
 
@@ -39,7 +141,7 @@ def main():
         )
 
     with cfg_path.open() as f:
-        cfg = yaml.safe_load(f) or {}
+        cfg = yaml.load(f, Loader=_SafeLoader) or {}
 
     # 'project' inside YAML (optional but nice consistency check)
     project_name = cfg.get("project", project_arg)
@@ -66,18 +168,22 @@ def main():
     print(f"Reading config: {cfg_path}")
     print(f"Loading network: {net_path}")
 
+    # heavy deps are imported only once the inputs have been validated
+    import folium
+
     # --------------------------------------------------------------
     # Load network
     # --------------------------------------------------------------
-    n = Network(str(net_path))
+    n = load_network(net_path)
 
     # --- timestep hours (robust) ---
     dt_hours = 1.0
     try:
         snaps = n.snapshots
         if len(snaps) > 1 and isinstance(snaps, pd.DatetimeIndex):
-            diffs = snaps.to_series().diff().dropna()
-            dt_hours = diffs.dt.total_seconds().median() / 3600.0
+            # median step in nanoseconds -> hours
+            ns = snaps.values.astype("datetime64[ns]").view(np.int64)
+            dt_hours = float(np.median(np.diff(ns))) / 3.6e12
     except Exception:
         dt_hours = 1.0
 
@@ -87,9 +193,21 @@ def main():
 
     # --- compute total demand per bus (TWh) ---
     if hasattr(n, "loads_t") and hasattr(n.loads_t, "p_set"):
-        energy_mwh_per_load = n.loads_t.p_set.sum(axis=0) * dt_hours
-        load_bus_map = n.loads["bus"]
-        energy_mwh_per_bus = energy_mwh_per_load.groupby(load_bus_map).sum()
+        from scipy.sparse import csr_matrix
+
+        p_set = n.loads_t.p_set
+        energy_mwh_per_load = np.nansum(p_set.to_numpy(dtype=float), axis=0) * dt_hours
+
+        # load -> bus incidence matrix (loads with an unknown bus are left out)
+        bus_ix = n.buses.index.get_indexer(n.loads["bus"].reindex(p_set.columns).to_numpy())
+        load_ix = np.flatnonzero(bus_ix >= 0)
+        incidence = csr_matrix(
+            (np.ones(len(load_ix)), (load_ix, bus_ix[load_ix])),
+            shape=(len(p_set.columns), len(n.buses.index)),
+        )
+        energy_mwh_per_bus = pd.Series(
+            incidence.T @ energy_mwh_per_load, index=n.buses.index
+        )
     else:
         energy_mwh_per_bus = pd.Series(dtype=float)
 
@@ -97,95 +215,60 @@ def main():
         energy_mwh_per_bus / 1e6
     ).reindex(index=n.buses.index).fillna(0.0)
 
-    # --- compute installed capacities per bus (GW) from generators + storage_units ---
-    gen_cap_mw = pd.Series(0.0, index=n.buses.index)
-
-    if len(n.generators) > 0:
-        gen_caps = n.generators.get("p_nom", pd.Series(0.0)).fillna(0.0)
-        gen_caps_by_bus = gen_caps.groupby(n.generators["bus"]).sum()
-        gen_cap_mw = gen_cap_mw.add(gen_caps_by_bus, fill_value=0.0)
-
-    if len(n.storage_units) > 0:
-        stor_caps = n.storage_units.get("p_nom", pd.Series(0.0)).fillna(0.0)
-        stor_caps_by_bus = stor_caps.groupby(n.storage_units["bus"]).sum()
-        gen_cap_mw = gen_cap_mw.add(stor_caps_by_bus, fill_value=0.0)
-
-    gen_cap_gw = (gen_cap_mw / 1000.0).reindex(index=n.buses.index).fillna(0.0)
-
-    # --- installed capacities aggregated by type (for popup on click) ---
+    # --- installed capacities from generators + storage_units, stacked into one frame ---
     def _type_col(df):
         for c in ("carrier", "type", "technology"):
             if c in df.columns:
                 return c
         return None
 
-    gen_type_col = _type_col(n.generators) if len(n.generators) > 0 else None
-    stor_type_col = _type_col(n.storage_units) if len(n.storage_units) > 0 else None
+    def _caps_frame(df, kind):
+        # one row per unit: (kind, bus, type, p_nom); without a type column all units
+        # of this kind are grouped under 'generator' / 'storage'
+        type_col = _type_col(df)
+        return pd.DataFrame({
+            "kind": kind,
+            "bus": df.get("bus", pd.Series(dtype=object, index=df.index)),
+            "type": df[type_col] if type_col is not None else kind,
+            "p_nom": df.get("p_nom", pd.Series(0.0, index=df.index)),
+        })
+
+    caps = pd.concat(
+        [_caps_frame(n.generators, "generator"), _caps_frame(n.storage_units, "storage")],
+        ignore_index=True,
+    ).fillna({"p_nom": 0.0})
+
+    # total per bus (GW)
+    gen_cap_gw = (
+        caps.groupby("bus")["p_nom"].sum() / 1000.0
+    ).reindex(index=n.buses.index).fillna(0.0)
 
-    # generators by (bus, type) in MW
-    if len(n.generators) > 0 and gen_type_col is not None:
-        gen_by_bus_type = (
-            n.generators.fillna({"p_nom": 0.0})
-            .groupby(["bus", gen_type_col])["p_nom"]
-            .sum()
-        )
-    else:
-        # fallback: treat all generators as a single group 'generator'
-        gen_by_bus_type = (
-            n.generators.get("p_nom", pd.Series(0.0))
-            .groupby(n.generators.get("bus", pd.Series()))
-            .sum()
-        )
-        gen_by_bus_type.index = pd.MultiIndex.from_tuples(
-            [(b, "generator") for b in gen_by_bus_type.index],
-            names=["bus", "type"],
-        )
+    # per-bus dict of type -> GW for each kind (for popup on click): one groupby,
+    # then a single pass over the result instead of slicing it per bus
+    caps_by_kind_bus_type_gw = caps.groupby(["kind", "bus", "type"])["p_nom"].sum() / 1000.0
+    types_gw = {"generator": {}, "storage": {}}
+    for (kind, bus, t), gw in caps_by_kind_bus_type_gw.items():
+        types_gw[kind].setdefault(bus, {})[str(t)] = float(gw)
+    gen_dict = types_gw["generator"]
+    stor_dict = types_gw["storage"]
 
-    # storage by (bus, type) in MW
-    if len(n.storage_units) > 0 and stor_type_col is not None:
-        stor_by_bus_type = (
-            n.storage_units.fillna({"p_nom": 0.0})
-            .groupby(["bus", stor_type_col])["p_nom"]
-            .sum()
-        )
-    else:
-        stor_by_bus_type = (
-            n.storage_units.get("p_nom", pd.Series(0.0))
-            .groupby(n.storage_units.get("bus", pd.Series()))
-            .sum()
-        )
-        stor_by_bus_type.index = pd.MultiIndex.from_tuples(
-            [(b, "storage") for b in stor_by_bus_type.index],
-            names=["bus", "type"],
-        )
-
-    # helper to extract per-bus dict of type -> GW
-    def _types_for_bus(series_multiindex, bus):
-        out = {}
-        try:
-            s = series_multiindex.xs(bus, level="bus")
-            for t, val in s.items():
-                out[str(t)] = float(val) / 1000.0
-        except KeyError:
-            pass
-        return out
+    # --- bus coordinates as plain dicts (reused for bus markers and line/link endpoints) ---
+    bx = n.buses["x"].astype(float).to_dict()
+    by = n.buses["y"].astype(float).to_dict()
 
     # --- prepare bus properties (for tooltip + popup) ---
+    demand_twh = energy_twh_per_bus.reindex(selected_buses).round(6).to_dict()
+    installed_gw = gen_cap_gw.reindex(selected_buses).round(6).to_dict()
+
     bus_props = {}
     for b in selected_buses:
-        x = float(n.buses.at[b, "x"])
-        y = float(n.buses.at[b, "y"])
-        demand_twh = round(float(energy_twh_per_bus.get(b, 0.0)), 6)
-        installed_gw = round(float(gen_cap_gw.get(b, 0.0)), 6)
-        gen_types = _types_for_bus(gen_by_bus_type, b)
-        stor_types = _types_for_bus(stor_by_bus_type, b)
         bus_props[b] = {
-            "x": x,
-            "y": y,
-            "demand_twh": demand_twh,
-            "installed_gw": installed_gw,
-            "gen_types_gw": gen_types,
-            "stor_types_gw": stor_types,
+            "x": bx[b],
+            "y": by[b],
+            "demand_twh": float(demand_twh[b]),
+            "installed_gw": float(installed_gw[b]),
+            "gen_types_gw": sorted(gen_dict.get(b, {}).items()),
+            "stor_types_gw": sorted(stor_dict.get(b, {}).items()),
         }
 
     # --- select lines/links connecting only two selected buses ---
@@ -200,26 +283,26 @@ def main():
     ].copy()
 
     # suppress lines that have a link between same unordered pair (prioritise links)
-    link_pairs = {
-        tuple(sorted([r.bus0, r.bus1])) for _, r in sel_links.iterrows()
-    }
+    lb0 = sel_links["bus0"].to_numpy()
+    lb1 = sel_links["bus1"].to_numpy()
+    link_pairs = set(zip(np.minimum(lb0, lb1), np.maximum(lb0, lb1)))
     if not sel_lines.empty:
-        sel_lines["pair"] = sel_lines.apply(
-            lambda r: tuple(sorted([r.bus0, r.bus1])),
-            axis=1,
-        )
+        b0 = sel_lines["bus0"].to_numpy()
+        b1 = sel_lines["bus1"].to_numpy()
+        sel_lines["pair"] = list(zip(np.minimum(b0, b1), np.maximum(b0, b1)))
         sel_lines = sel_lines[~sel_lines["pair"].isin(link_pairs)]
 
-    # --- helper to format capacity (MW) ---
-    def cap_mw_from_line(r):
-        if not pd.isna(r.get("s_nom", np.nan)):
-            return float(r.get("s_nom"))
-        if "capacity" in r:
-            return float(r.get("capacity", np.nan))
-        return np.nan
+    # --- transfer capacity (MW) per line/link, NaN where unknown ---
+    def _nan_col(df):
+        return pd.Series(np.nan, index=df.index)
 
-    def cap_mw_from_link(r):
-        return float(r.get("p_nom", np.nan)) if not pd.isna(r.get("p_nom", np.nan)) else np.nan
+    line_caps = sel_lines.get("s_nom", _nan_col(sel_lines))
+    if "capacity" in sel_lines.columns:
+        line_caps = line_caps.fillna(sel_lines["capacity"])
+    sel_lines = sel_lines.assign(_cap_mw=line_caps.astype(float))
+    sel_links = sel_links.assign(
+        _cap_mw=sel_links.get("p_nom", _nan_col(sel_links)).astype(float)
+    )
 
     # --- build folium map centered on mean coords ---
     if len(coords) > 0:
@@ -232,21 +315,29 @@ def main():
         location=[center_lat, center_lon],
         zoom_start=6,
         tiles="cartodbpositron",
+        prefer_canvas=True,  # draw vector features on one canvas instead of one DOM node each
     )
 
+    # one layer per feature kind (buses added last so they stay on top)
+    lines_fg = folium.FeatureGroup(name="Lines").add_to(m)
+    links_fg = folium.FeatureGroup(name="Links").add_to(m)
+    buses_fg = folium.FeatureGroup(name="Buses").add_to(m)
+
     # draw lines (grey)
-    for _, row in sel_lines.iterrows():
-        b0 = row.bus0
-        b1 = row.bus1
-        x0, y0 = float(n.buses.at[b0, "x"]), float(n.buses.at[b0, "y"])
-        x1, y1 = float(n.buses.at[b1, "x"]), float(n.buses.at[b1, "y"])
-        capacity = cap_mw_from_line(row)
+    for name, b0, b1, capacity in zip(
+        sel_lines.index,
+        sel_lines["bus0"].to_numpy(),
+        sel_lines["bus1"].to_numpy(),
+        sel_lines["_cap_mw"].to_numpy(),
+    ):
+        x0, y0 = bx[b0], by[b0]
+        x1, y1 = bx[b1], by[b1]
 
         line_tooltip = (
-            f"Line {row.name if hasattr(row, 'name') else ''}<br>"
+            f"Line {name}<br>"
             f"Bus0: {b0}<br>"
             f"Bus1: {b1}<br>"
-            f"Transfer capacity: {capacity if not np.isnan(capacity) else 'n/a'} MW"
+            f"Transfer capacity: {'n/a' if capacity != capacity else capacity} MW"
         )
 
         folium.PolyLine(
@@ -255,21 +346,23 @@ def main():
             weight=2,
             opacity=0.8,
             tooltip=folium.Tooltip(line_tooltip, sticky=True),
-        ).add_to(m)
+        ).add_to(lines_fg)
 
     # draw links (orange, same width)
-    for _, row in sel_links.iterrows():
-        b0 = row.bus0
-        b1 = row.bus1
-        x0, y0 = float(n.buses.at[b0, "x"]), float(n.buses.at[b0, "y"])
-        x1, y1 = float(n.buses.at[b1, "x"]), float(n.buses.at[b1, "y"])
-        capacity = cap_mw_from_link(row)
+    for name, b0, b1, capacity in zip(
+        sel_links.index,
+        sel_links["bus0"].to_numpy(),
+        sel_links["bus1"].to_numpy(),
+        sel_links["_cap_mw"].to_numpy(),
+    ):
+        x0, y0 = bx[b0], by[b0]
+        x1, y1 = bx[b1], by[b1]
 
         link_tooltip = (
-            f"Link {row.name if hasattr(row, 'name') else ''}<br>"
+            f"Link {name}<br>"
             f"Bus0: {b0}<br>"
             f"Bus1: {b1}<br>"
-            f"Transfer capacity: {capacity if not np.isnan(capacity) else 'n/a'} MW"
+            f"Transfer capacity: {'n/a' if capacity != capacity else capacity} MW"
         )
 
         folium.PolyLine(
@@ -278,42 +371,40 @@ def main():
             weight=2,
             opacity=0.9,
             tooltip=folium.Tooltip(link_tooltip, sticky=True),
-        ).add_to(m)
-
-    # draw buses as circle markers with popups
-    for b, p in bus_props.items():
-        hover_txt = (
-            f"{b}:<br>"
-            f"Load: {p['demand_twh']:.6f} TWh<br>"
-            f"Total installed capacities: {p['installed_gw']:.6f} GW"
-        )
+        ).add_to(links_fg)
 
-        parts = [
-            f"<b>{b}</b>",
-            f"Coordinates: {p['x']:.4f}, {p['y']:.4f}",
-            f"Total demand: {p['demand_twh']:.6f} TWh",
-            f"Total installed capacity: {p['installed_gw']:.6f} GW",
-            "<hr>",
-            "<b>Installed capacities by type (GW)</b>",
-        ]
+    # --- popup lines for a bus (type lists are pre-sorted in bus_props) ---
+    def _iter_popup(b, p):
+        yield f"<b>{b}</b>"
+        yield f"Coordinates: {p['x']:.4f}, {p['y']:.4f}"
+        yield f"Total demand: {p['demand_twh']:.6f} TWh"
+        yield f"Total installed capacity: {p['installed_gw']:.6f} GW"
+        yield "<hr>"
+        yield "<b>Installed capacities by type (GW)</b>"
 
         # generators
-        parts.append("<u>Generators</u>")
+        yield "<u>Generators</u>"
         if p["gen_types_gw"]:
-            for t, gw in sorted(p["gen_types_gw"].items()):
-                parts.append(f"{t}: {gw:.6f} GW")
+            yield from (f"{t}: {gw:.6f} GW" for t, gw in p["gen_types_gw"])
         else:
-            parts.append("none")
+            yield "none"
 
         # storage
-        parts.append("<u>Storage</u>")
+        yield "<u>Storage</u>"
         if p["stor_types_gw"]:
-            for t, gw in sorted(p["stor_types_gw"].items()):
-                parts.append(f"{t}: {gw:.6f} GW")
+            yield from (f"{t}: {gw:.6f} GW" for t, gw in p["stor_types_gw"])
         else:
-            parts.append("none")
+            yield "none"
 
-        popup_html = "<br>".join(parts)
+    # draw buses as circle markers with popups
+    for b, p in bus_props.items():
+        hover_txt = (
+            f"{b}:<br>"
+            f"Load: {p['demand_twh']:.6f} TWh<br>"
+            f"Total installed capacities: {p['installed_gw']:.6f} GW"
+        )
+
+        popup_html = "<br>".join(_iter_popup(b, p))
 
         folium.CircleMarker(
             location=[p["y"], p["x"]],
@@ -323,7 +414,9 @@ def main():
             fill_color="red",
             popup=folium.Popup(popup_html, max_width=350),
             tooltip=folium.Tooltip(hover_txt, sticky=True),
-        ).add_to(m)
+        ).add_to(buses_fg)
+
+    folium.LayerControl(collapsed=True).add_to(m)
 
     # --------------------------------------------------------------
     # Save and display
@@ -332,11 +425,24 @@ def main():
     out_dir.mkdir(parents=True, exist_ok=True)
 
     out_file = out_dir / "network_map.html"
-    m.save(out_file)
+    html = m.get_root().render()
+    # cheap minification: folium's bulk whitespace is per-line indentation (mostly inside
+    # <script>), so drop that and blank lines, then whitespace-only runs between tags.
+    # Tooltip/popup text only loses HTML-insignificant whitespace around its <div> content.
+    html = re.sub(r"\n\s+", "\n", html)
+    html = re.sub(r">\s+<", "><", html)
+    out_file.write_text(html, encoding="utf-8")
     print(f"Saved map to: {out_file}")
 
+    if args.gzip:
+        gz_file = out_file.with_name(out_file.name + ".gz")
+        with gzip.open(gz_file, "wt", encoding="utf-8", compresslevel=6) as f:
+            f.write(html)
+        print(f"Saved compressed map to: {gz_file}")
+
     # Show in notebook contexts (harmless in CLI)
     try:
+        from IPython.display import display
         display(m)
     except Exception:
         pass
@@ -1,12 +1,25 @@
 import json
+import os
 import yaml
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from urllib.parse import quote
 from jinja2 import Environment, FileSystemLoader
 import argparse
 import sys
 
+try:
+    import orjson
+except ImportError:  # optional, falls back to stdlib json
+    orjson = None
+
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:  # libyaml not available
+    from yaml import SafeLoader as _SafeLoader
+
 # map generation deps (used only if network_file configured)
 #import pypsa
 #import folium
@@ -14,6 +27,43 @@ import sys
 #import pandas as pd
 
 
+@lru_cache(maxsize=8)
+def _load_env(templates_dir: str) -> Environment:
+    """
+    Jinja environment per templates folder. The environment keeps compiled templates
+    in its own cache (reloaded if the file changes), so repeated renders skip re-parsing.
+    """
+    return Environment(
+        loader=FileSystemLoader(templates_dir),
+        autoescape=True,
+    )
+
+
+@lru_cache(maxsize=64)
+def _load_yaml_cached(path: str, mtime: float):
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=_SafeLoader)
+
+
+def load_yaml(path: Path):
+    """
+    Parse a YAML file once per (path, mtime); editing the file invalidates the cache.
+    The parsed object is shared between callers, so treat it as read-only.
+    """
+    return _load_yaml_cached(str(path), path.stat().st_mtime)
+
+
+def to_json(obj) -> str:
+    """
+    Compact JSON for embedding in the page's <script> block (no whitespace after separators).
+    Uses orjson when installed (UTF-8, compact by default), else the stdlib encoder.
+    """
+    if orjson is not None:
+        # YAML may yield non-string keys (e.g. years); stdlib json stringifies those too
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
 def to_web_url(path: Path) -> str:
     """
     Convert a relative path (e.g. assets/...) to a URL-safe string for the browser.
@@ -26,19 +76,137 @@ def discover_buses(plots_root: Path):
     """
     Buses are inferred as subdirectories of a scenario's plots folder (e.g. UA, MD, RO).
     """
-    buses = []
-    if not plots_root.exists():
-        return buses
+    # scandir entries carry the file type from readdir, so is_dir() needs no extra stat
+    try:
+        with os.scandir(plots_root) as it:
+            return sorted(e.name for e in it if e.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+COPY_MODES = ("link", "copy", "reflink")
+
+
+def copy_asset(src: Path, dst: Path, mode: str = "link") -> str:
+    """
+    Stage a plot file under output/assets/... and return how it was actually staged
+    ("link", "reflink" or "copy").
+
+    - "link":    hardlink (metadata-only), falling back to a regular copy where links are refused
+    - "reflink": os.copy_file_range (lets btrfs/xfs share extents), falling back to a regular copy
+    - "copy":    plain shutil.copy2
+    """
+    # os.link refuses to overwrite, and an old copy must not be written through either
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+
+    if mode == "link":
+        try:
+            os.link(src, dst)
+            return "link"
+        except OSError:
+            pass
+    elif mode == "reflink" and hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                shutil.copystat(src, dst)
+                return "reflink"
+        except OSError:
+            pass
+
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def manifest_path_for(assets_root: Path) -> Path:
+    """
+    The manifest sits next to assets_root (e.g. output/<project>/.assets_manifest.json)
+    so it is not published with the assets; the name is git-ignored.
+    """
+    return assets_root.with_name(f".{assets_root.name}_manifest.json")
+
+
+def load_manifest(assets_root: Path):
+    """
+    Manifest from the previous build, or None if there is none (or it is unreadable).
+    """
+    manifest_path = manifest_path_for(assets_root)
+    if not manifest_path.exists():
+        return None
+    try:
+        with manifest_path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-    for p in plots_root.iterdir():
-        if p.is_dir():
-            buses.append(p.name)
-    return sorted(buses)
+
+def needs_copy(src: Path, dst: Path, mode: str = "link", entry: dict = None) -> bool:
+    """
+    True if dst is missing, out of date w.r.t. src (older mtime or different size),
+    or was staged under a different template.copy_mode than requested now according
+    to its previous manifest entry (untracked assets are re-staged once).
+    """
+    if entry is None or entry.get("copy_mode") != mode:
+        return True
+    try:
+        dst_stat = dst.stat()
+    except FileNotFoundError:
+        return True
+    src_stat = src.stat()
+    return dst_stat.st_mtime < src_stat.st_mtime or dst_stat.st_size != src_stat.st_size
 
 
-def build_scenarios_data(root: Path, config: dict, assets_root: Path):
+def sync_asset_manifest(assets_root: Path, staged: dict, previous: dict = None, prune: bool = True):
     """
-    Build nested dict and copy plots into output/assets/...:
+    Persist the manifest of staged assets (path relative to assets_root -> source
+    mtime/size, requested copy_mode and how the file was actually staged).
+    With prune=True, assets tracked from earlier builds that are no longer produced are
+    removed; otherwise they stay tracked so a later build can still prune them.
+    Without a readable manifest (first incremental build), every file already under
+    assets_root is treated as previously staged.
+    """
+    manifest_path = manifest_path_for(assets_root)
+    if previous is None:
+        previous = {
+            p.relative_to(assets_root).as_posix(): {}
+            for p in assets_root.rglob("*") if p.is_file()
+        }
+
+    stale = previous.keys() - staged.keys()
+    if prune:
+        for rel in stale:
+            stale_path = assets_root / rel
+            if stale_path.is_file():
+                stale_path.unlink()
+                print(f"  Removed stale asset: {stale_path}")
+            # drop emptied bus/scenario folders
+            for parent in stale_path.parents:
+                if parent == assets_root:
+                    break
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+        manifest = staged
+    else:
+        manifest = {**{rel: previous[rel] for rel in stale}, **staged}
+
+    with manifest_path.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def build_scenarios_data(root: Path, config: dict, assets_root: Path, prune: bool = True):
+    """
+    Build nested dict and copy plots into output/assets/...
+    Only new or changed plots are copied; with prune=True, assets left over from
+    previous builds (tracked in the manifest next to assets_root) are removed.
 
     scenarios_data = {
       scenario_key: {
@@ -64,7 +232,17 @@ def build_scenarios_data(root: Path, config: dict, assets_root: Path):
     plots_root_cfg = Path(config.get("plots_root", "plots"))
     project = config.get("project", "").strip()
 
+    copy_mode = (config.get("template", {}) or {}).get("copy_mode", "link")
+    if copy_mode not in COPY_MODES:
+        raise ValueError(
+            f"Unknown template.copy_mode '{copy_mode}'. Expected one of: {', '.join(COPY_MODES)}"
+        )
+
     all_data = {}
+    previous = load_manifest(assets_root)
+    previous_entries = previous or {}
+    copy_jobs = []  # (rel, src, dst), copied in parallel once all scenarios are walked
+    staged = {}     # manifest entries: asset path relative to assets_root -> see sync_asset_manifest
 
     for scen_key, meta in scenarios_cfg.items():
         scen_name = meta.get("name", scen_key)
@@ -100,6 +278,10 @@ def build_scenarios_data(root: Path, config: dict, assets_root: Path):
             print(f"  Bus '{bus}' in folder: {bus_dir}")
             bus_figs = {}
 
+            # one readdir per bus instead of a stat per expected figure
+            with os.scandir(bus_dir) as it:
+                present = {e.name for e in it if e.is_file()}
+
             for fig_id, fig_meta in figures_cfg.items():
                 pattern = fig_meta["pattern"]
                 title = fig_meta.get("title", fig_id)
@@ -110,8 +292,18 @@ def build_scenarios_data(root: Path, config: dict, assets_root: Path):
                 target_path = web_bus_dir / filename # copied under ./output/assets/...
                 web_rel_path = Path("assets") / scen_key / bus / filename  # path used in HTML
 
-                if fig_path.exists():
-                    shutil.copy2(fig_path, target_path)
+                if filename in present:
+                    rel = (Path(scen_key) / bus / filename).as_posix()
+                    entry = previous_entries.get(rel)
+                    src_stat = fig_path.stat()
+                    staged[rel] = {
+                        "mtime": src_stat.st_mtime,
+                        "size": src_stat.st_size,
+                        "copy_mode": copy_mode,
+                        "staged_as": (entry or {}).get("staged_as"),
+                    }
+                    if needs_copy(fig_path, target_path, copy_mode, entry):
+                        copy_jobs.append((rel, fig_path, target_path))
                     url = to_web_url(web_rel_path)
                     print(f"    Found {fig_id}: {fig_path} -> {target_path}")
                 else:
@@ -128,6 +320,18 @@ def build_scenarios_data(root: Path, config: dict, assets_root: Path):
 
         all_data[scen_key] = scenario_entry
 
+    # Copying is I/O bound, so overlap the many small PNG copies across threads.
+    if copy_jobs:
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            staged_as = ex.map(lambda job: copy_asset(job[1], job[2], mode=copy_mode), copy_jobs)
+            for (rel, _, _), how in zip(copy_jobs, staged_as):
+                staged[rel]["staged_as"] = how
+        print(f"\nStaged {len(copy_jobs)} figure(s) into {assets_root} (copy_mode: {copy_mode})")
+    print(f"{len(staged) - len(copy_jobs)} figure(s) already up to date")
+
+    sync_asset_manifest(assets_root, staged, previous=previous, prune=prune)
+
     return all_data
 
 
@@ -142,13 +346,13 @@ def render_onepager(root: Path, config: dict, scenarios_data, output_root: Path
     else:
         text_config_path = Path(config.get("_text_config_path", "")) if config.get("_text_config_path") else root / "config" / "onepager_text.yaml"
         if text_config_path.exists():
-            with text_config_path.open("r", encoding="utf-8") as f:
-                text_config = yaml.safe_load(f)
+            text_config = load_yaml(text_config_path)
         else:
             # keep an empty text_config to avoid template hard crash; template should handle missing keys gracefully
             text_config = {}
 
-    text_config_json = json.dumps(text_config, ensure_ascii=False)
+    # The template needs both: text_config for Jinja lookups, text_config_json for the JS side
+    text_config_json = to_json(text_config)
 
     # --- Template/output config ---
     template_cfg = config["template"]
@@ -157,20 +361,9 @@ def render_onepager(root: Path, config: dict, scenarios_data, output_root: Path
     output_dir_name = template_cfg.get("output_dir", "output")
 
     # --- Jinja environment ---
-    env = Environment(
-        loader=FileSystemLoader(root / "templates"),
-        autoescape=True,
-    )
+    env = _load_env(str(root / "templates"))
     template = env.get_template(template_name)
 
-    html_output = template.render(
-        scenarios_json=json.dumps(scenarios_data, ensure_ascii=False),
-        text_config=text_config,
-        text_config_json=text_config_json,
-        default_scenario=config.get("default_scenario", ""),
-        default_bus=config.get("default_bus", ""),
-    )
-
     # Resolve final output_root: prefer explicit output_root param (from main),
     # otherwise fall back to template.output_dir under repo root.
     if output_root is None:
@@ -178,7 +371,22 @@ def render_onepager(root: Path, config: dict, scenarios_data, output_root: Path
     output_root.mkdir(parents=True, exist_ok=True)
     out_path = output_root / output_html_name
     print(f"[DEBUG] writing output to: {out_path.resolve()}")
-    out_path.write_text(html_output, encoding="utf-8")
+
+    # Stream the render straight to disk instead of building the whole HTML string first.
+    # Render into a sibling temp file and swap it in, so a failing render keeps the last good page.
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    try:
+        template.stream(
+            scenarios_json=to_json(scenarios_data),
+            text_config=text_config,
+            text_config_json=text_config_json,
+            default_scenario=config.get("default_scenario", ""),
+            default_bus=config.get("default_bus", ""),
+        ).dump(str(tmp_path), encoding="utf-8")
+        os.replace(tmp_path, out_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
     print(f"\nWrote {out_path.resolve()}")
     print(f"[DEBUG] output file size: {out_path.stat().st_size} bytes")
 
@@ -231,15 +439,13 @@ def main():
 
     # --- Load configuration (existing logic) ---
     if onepager_path.exists():
-        with onepager_path.open("r", encoding="utf-8") as f:
-            config = yaml.safe_load(f) or {}
+        config = load_yaml(onepager_path) or {}
         print(f"[DEBUG] Loaded combined onepager config: {onepager_path}")
     else:
         # fallback to older split files
         if not cfg_path or not cfg_path.exists():
             raise FileNotFoundError(f"Config YAML not found: {cfg_path}")
-        with cfg_path.open("r", encoding="utf-8") as f:
-            config = yaml.safe_load(f) or {}
+        config = load_yaml(cfg_path) or {}
         print(f"[DEBUG] Loaded legacy config: {cfg_path} (text path: {config.get('_text_config_path')})")
 
     # Print resolved template/output targets
@@ -264,12 +470,10 @@ def main():
     assets_root = output_root / tpl.get("assets_subdir", "assets")
     assets_root.mkdir(parents=True, exist_ok=True)
 
-    # Clean old assets (optional; comment out if you want to keep them)
-    if assets_root.exists() and not args.keep_assets:
-        shutil.rmtree(assets_root)
-
-    assets_root.mkdir(parents=True, exist_ok=True)
-    scenarios_data = build_scenarios_data(root=root, config=config, assets_root=assets_root)
+    # Assets are updated incrementally; stale ones are pruned unless --keep-assets is given
+    scenarios_data = build_scenarios_data(
+        root=root, config=config, assets_root=assets_root, prune=not args.keep_assets
+    )
 
     render_onepager(root=root, config=config, scenarios_data=scenarios_data, output_root=output_root)
 